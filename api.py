@@ -1,13 +1,25 @@
 import asyncio
+import hashlib
 import os
 import shutil
+import threading
+import time
 import logging
 import traceback
+import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
+import anyio
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import (
+    FastAPI, BackgroundTasks, HTTPException, Request, Response, Query as QueryParam
+)
 from pydantic import BaseModel
 import uvicorn
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
 from mcp_agent.core.fastagent import FastAgent
 
 # Set up logging
@@ -17,8 +29,26 @@ logger = logging.getLogger(__name__)
 # Load API key from .env file
 dotenv_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path)
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # fast-agent reads the key from the environment; refuse to start without it
+    # rather than failing every query later
+    if not ANTHROPIC_API_KEY:
+        logger.error("ANTHROPIC_API_KEY not found in .env file")
+        raise RuntimeError("ANTHROPIC_API_KEY not found in .env file")
+    
+    # Warm up the shared agent in the background so the first query doesn't
+    # pay for MCP server startup, and shut it down with the server
+    start_agent()
+    yield
+    await stop_agent()
+
+app = FastAPI(lifespan=lifespan)
+app.state.agent_task = None
+app.state.agent_ready = None
+app.state.agent_stop = None
 
 # Create a dedicated workspace directory for the agent
 WORKSPACE_DIR = Path(__file__).parent / "agent_workspace"
@@ -84,68 +114,241 @@ Examples of useful commands:
 Always check the current status and provide clear explanations of what commands you're using.
 """
 
+FORMATTED_AGENT_INSTRUCTIONS = AGENT_INSTRUCTIONS.format(workspace_dir=WORKSPACE_DIR)
+
 class Query(BaseModel):
     text: str
 
-# Store active tasks
-active_tasks = {}
+# Store active tasks, evicting them an hour after their last update
+TASK_TTL_SECONDS = 3600
+MAX_TASKS = 10000
+active_tasks = TTLCache(maxsize=MAX_TASKS, ttl=TASK_TTL_SECONDS)
 
-# Function to run agent
-async def run_agent(query_id: str, query_text: str):
-    # Verify API key is loaded from .env
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        logger.error("ANTHROPIC_API_KEY not found in .env file")
-        active_tasks[query_id] = {"status": "error", "result": "Error: ANTHROPIC_API_KEY not found in .env file"}
-        return
+# Completion events for tasks that are still processing, used by long-polling
+task_events = {}
+
+# Upper bound for the long-poll wait on /result/{query_id}
+MAX_RESULT_WAIT = 60
+
+# Name of the agent declared on the shared FastAgent
+AGENT_NAME = "github_agent"
+
+# Maximum number of queries handled by the shared agent at the same time
+MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))
+if MAX_CONCURRENCY < 1:
+    raise ValueError("AGENT_MAX_CONCURRENCY must be at least 1")
+agent_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+# Agents being shut down after losing their MCP connection
+retired_agents = set()
+
+# Cached /workspace_info walks keyed by request parameters and validated by
+# directory mtimes. Worker threads use it, hence the threading lock.
+tree_cache = {}
+tree_cache_lock = threading.Lock()
+TREE_CACHE_SIZE = 64
+
+# A directory whose mtime is this close to the start of a walk may change again
+# without its mtime moving, given coarse filesystem timestamps. Like git's racily
+# clean index entries, such walks are neither cached nor given an ETag.
+RACY_MTIME_WINDOW_NS = 2_000_000_000
+
+class WorkspaceLock:
+    """Reader/writer lock letting /workspace_info walks overlap but not a reset
     
-    # Set it as environment variable for fast-agent
-    os.environ["ANTHROPIC_API_KEY"] = api_key
+    Walks hold it shared and resets hold it exclusively. A waiting reset
+    blocks new walks so a steady stream of them cannot starve it.
+    """
     
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+    
+    @asynccontextmanager
+    async def shared(self):
+        async with self._cond:
+            await self._cond.wait_for(
+                lambda: not self._writing and not self._writers_waiting
+            )
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+    
+    @asynccontextmanager
+    async def exclusive(self):
+        async with self._cond:
+            self._writers_waiting += 1
+            try:
+                await self._cond.wait_for(
+                    lambda: not self._writing and not self._readers
+                )
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+# Keeps workspace resets from deleting the tree under /workspace_info walks,
+# which both run in threads
+workspace_lock = WorkspaceLock()
+
+# Deepest /workspace_info listing a client may request in one call
+MAX_TREE_DEPTH = 20
+
+# Directories left out of /workspace_info by default: VCS metadata, dependency
+# installs and caches that dwarf the source tree without being useful to browse
+PRUNED_DIRS = frozenset({".git", "node_modules", "__pycache__", ".venv"})
+
+def finish_task(query_id: str, status: str, result: str):
+    """Store the final state of a task and wake up any clients long-polling for it"""
+    active_tasks[query_id] = {"status": status, "result": result}
+    event = task_events.pop(query_id, None)
+    if event is not None:
+        event.set()
+
+def forget_agent_state(agent):
+    """Drop the messages and usage fast-agent records for every call
+    
+    fast-agent appends each query and its full response (tool output included)
+    to the LLM's message history and adds a usage turn per LLM call, even with
+    use_history=False. The shared agent never exits, so clear them after each
+    query. Nothing here is sent to the model, so clearing while another query
+    is in flight is harmless.
+    """
+    agent.message_history.clear()
+    if agent.usage_accumulator is not None:
+        agent.usage_accumulator.turns.clear()
+
+async def serve_agent(ready: asyncio.Future, stop: asyncio.Event):
+    """Run a FastAgent until `stop` is set, publishing the agent through `ready`
+    
+    The agent is entered and exited in this one task so that the MCP server
+    connections it owns are torn down from the task that opened them.
+    """
     try:
-        # Log starting agent
-        logger.info(f"Starting agent for query_id: {query_id}, text: {query_text}")
-        
-        # Create a new agent
-        fast = FastAgent("GitHub CLI Agent")
-        
-        # Format the instructions with the workspace directory
-        formatted_instructions = AGENT_INSTRUCTIONS.format(workspace_dir=WORKSPACE_DIR)
-        
-        logger.info(f"Initialized FastAgent for query_id: {query_id}")
+        fast = FastAgent("GitHub CLI Agent", parse_cli_args=False)
         
+        # Queries are independent, so don't carry one query's messages into
+        # the next: history would grow without bound and leak between clients
         @fast.agent(
-            instruction=formatted_instructions,
+            name=AGENT_NAME,
+            instruction=FORMATTED_AGENT_INSTRUCTIONS,
             servers=["cli"],
-            model="sonnet"
+            model="sonnet",
+            use_history=False
         )
-        async def agent_query():
+        async def github_agent():
+            pass
+        
+        async with fast.run() as agent_app:
+            agent = agent_app[AGENT_NAME]
+            
+            async def send_query(query_text):
+                try:
+                    return await agent.send(query_text)
+                finally:
+                    forget_agent_state(agent)
+            
+            logger.info("Shared agent started")
+            ready.set_result(send_query)
+            await stop.wait()
+        logger.info("Shared agent stopped")
+    except (Exception, SystemExit) as e:
+        # fast-agent raises SystemExit when an MCP server fails to start
+        logger.error(f"Error running shared agent: {str(e)}")
+        logger.error(traceback.format_exc())
+        if not ready.done():
+            ready.set_exception(RuntimeError(f"Agent failed to start: {str(e)}"))
+
+def retrieve_exception(future: asyncio.Future):
+    """Mark a failed warm-up as handled; serve_agent has already logged it"""
+    if not future.cancelled():
+        future.exception()
+
+def is_connection_error(e: Exception) -> bool:
+    """Return True if `e` means the agent lost its connection to an MCP server"""
+    if isinstance(e, McpError):
+        return e.error.code == CONNECTION_CLOSED
+    return isinstance(e, (
+        ConnectionError, EOFError, anyio.ClosedResourceError, anyio.BrokenResourceError,
+    ))
+
+def start_agent():
+    """Start the shared agent in the background unless it is already running"""
+    if app.state.agent_task is None or app.state.agent_task.done():
+        app.state.agent_ready = asyncio.get_running_loop().create_future()
+        app.state.agent_ready.add_done_callback(retrieve_exception)
+        app.state.agent_stop = asyncio.Event()
+        app.state.agent_task = asyncio.create_task(
+            serve_agent(app.state.agent_ready, app.state.agent_stop)
+        )
+    return app.state.agent_ready
+
+def retire_agent(ready: asyncio.Future):
+    """Shut down the agent published through `ready` so the next query starts afresh
+    
+    Does nothing if that agent has already been replaced. The old agent is
+    stopped in the background and awaited by stop_agent on shutdown.
+    """
+    if app.state.agent_ready is not ready or app.state.agent_task is None:
+        return
+    task = app.state.agent_task
+    app.state.agent_stop.set()
+    retired_agents.add(task)
+    task.add_done_callback(retired_agents.discard)
+    app.state.agent_task = None
+
+async def stop_agent():
+    """Stop the shared agent and wait for it to shut down"""
+    if app.state.agent_task is not None:
+        app.state.agent_stop.set()
+        await app.state.agent_task
+        app.state.agent_task = None
+    await asyncio.gather(*retired_agents)
+
+# Function to run agent
+async def run_agent(query_id: str, query_text: str):
+    try:
+        logger.info(f"Starting agent for query_id: {query_id}, text: {query_text}")
+        
+        # Reuse the shared agent, starting it if warm-up failed or hasn't run
+        ready = start_agent()
+        agent = await asyncio.shield(ready)
+        
+        async with agent_semaphore:
+            logger.info(f"Executing agent query for query_id: {query_id}")
             try:
-                logger.info(f"Agent running for query_id: {query_id}")
-                async with fast.run() as agent:
-                    logger.info(f"Executing agent query for query_id: {query_id}")
-                    result = await agent(query_text)
-                    logger.info(f"Agent query completed for query_id: {query_id}")
-                    return result
+                result = await agent(query_text)
             except Exception as e:
-                logger.error(f"Error inside agent_query for {query_id}: {str(e)}")
-                logger.error(traceback.format_exc())
+                # A dead MCP server would fail every later query on this agent
+                if is_connection_error(e):
+                    logger.warning("Shared agent lost its MCP connection, restarting")
+                    retire_agent(ready)
                 raise
         
-        logger.info(f"Calling agent_query for query_id: {query_id}")
-        result = await agent_query()
         logger.info(f"Got result for query_id: {query_id}: {result[:100]}...")
-        active_tasks[query_id] = {"status": "completed", "result": result}
+        finish_task(query_id, "completed", result)
     except Exception as e:
         logger.error(f"Error in run_agent for {query_id}: {str(e)}")
         logger.error(traceback.format_exc())
-        active_tasks[query_id] = {"status": "error", "result": f"Error: {str(e)}"}
+        finish_task(query_id, "error", f"Error: {str(e)}")
 
 @app.post("/query")
 async def create_query(query: Query, background_tasks: BackgroundTasks):
-    query_id = f"query_{len(active_tasks) + 1}"
+    query_id = uuid.uuid4().hex
     logger.info(f"Received new query: {query_id} - {query.text[:50]}...")
     active_tasks[query_id] = {"status": "processing", "result": None}
+    task_events[query_id] = asyncio.Event()
     
     # Run the agent in a background task
     background_tasks.add_task(run_agent, query_id, query.text)
@@ -154,68 +357,260 @@ async def create_query(query: Query, background_tasks: BackgroundTasks):
     return {"query_id": query_id, "status": "processing"}
 
 @app.get("/result/{query_id}")
-async def get_result(query_id: str):
+async def get_result(query_id: str, wait: float = 0):
+    """Return the state of a query, optionally waiting up to `wait` seconds for it"""
     if query_id not in active_tasks:
         return {"status": "not_found"}
     
-    logger.info(f"Returning result for query_id: {query_id}, status: {active_tasks[query_id]['status']}")
-    return active_tasks[query_id]
+    event = task_events.get(query_id)
+    if wait > 0 and event is not None:
+        try:
+            await asyncio.wait_for(event.wait(), timeout=min(wait, MAX_RESULT_WAIT))
+        except asyncio.TimeoutError:
+            pass
+    
+    # The task may have expired while we were waiting
+    task = active_tasks.get(query_id)
+    if task is None:
+        return {"status": "not_found"}
+    
+    logger.info(f"Returning result for query_id: {query_id}, status: {task['status']}")
+    return task
 
-@app.get("/workspace_info")
-async def workspace_info():
-    """Return information about the agent workspace"""
-    workspace_exists = os.path.exists(WORKSPACE_DIR)
+def directory_has_entries(path, prune=None):
+    """Return True if the directory at `path` has an entry not excluded by `prune`"""
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if (
+                    not prune
+                    or entry.name not in prune
+                    or not entry.is_dir(follow_symlinks=False)
+                ):
+                    return True
+    except OSError:
+        pass
+    return False
+
+def get_directory_tree(
+    root, rel_root="", max_depth=None, offset=0, limit=None, mtimes=None, prune=None
+):
+    """Build a nested file tree for `root` using an iterative os.scandir walk
     
-    # Generate a nested file tree instead of a flat list
-    def get_directory_tree(path, rel_path=""):
-        result = []
-        items = sorted(os.listdir(path))
+    Directories deeper than `max_depth` levels are not descended into and get a
+    `has_children` flag instead of `children`. `offset`/`limit` page through the
+    entries directly under `root`. Directories whose name is in `prune` are
+    skipped entirely. If `mtimes` is a list, (path, st_mtime_ns) is appended for
+    every directory read, taken before it is listed. Returns the tree and the
+    total number of entries directly under `root`.
+    """
+    tree = []
+    total = 0
+    stack = [(root, rel_root, tree, 1)]
+    
+    while stack:
+        path, rel_path, result, level = stack.pop()
+        try:
+            if mtimes is not None:
+                mtimes.append((path, os.stat(path).st_mtime_ns))
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            # Removed while we were walking; a None mtime never revalidates
+            if mtimes is not None:
+                mtimes.append((path, None))
+            continue
+        
+        if prune:
+            entries = [
+                entry for entry in entries
+                if entry.name not in prune or not entry.is_dir(follow_symlinks=False)
+            ]
         
-        for item in items:
-            item_path = os.path.join(path, item)
+        if level == 1:
+            total = len(entries)
+            end = offset + limit if limit is not None else None
+            entries = entries[offset:end]
+        
+        for entry in entries:
             if rel_path:
-                item_rel_path = os.path.join(rel_path, item)
+                item_rel_path = os.path.join(rel_path, entry.name)
             else:
-                item_rel_path = item
-                
-            if os.path.isdir(item_path):
-                children = get_directory_tree(item_path, item_rel_path)
-                result.append({
-                    "name": item,
+                item_rel_path = entry.name
+            
+            # DirEntry caches the file type from the directory listing,
+            # so this does not cost an extra stat call per entry
+            if entry.is_dir(follow_symlinks=False):
+                node = {
+                    "name": entry.name,
                     "path": item_rel_path,
-                    "type": "directory",
-                    "children": children
-                })
+                    "type": "directory"
+                }
+                if max_depth is None or level < max_depth:
+                    node["children"] = []
+                    stack.append(
+                        (entry.path, item_rel_path, node["children"], level + 1)
+                    )
+                else:
+                    if mtimes is not None:
+                        try:
+                            mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+                        except FileNotFoundError:
+                            mtime = None
+                        mtimes.append((entry.path, mtime))
+                    node["has_children"] = directory_has_entries(entry.path, prune)
+                result.append(node)
             else:
                 result.append({
-                    "name": item,
+                    "name": entry.name,
                     "path": item_rel_path,
                     "type": "file"
                 })
-        
-        return result
+    
+    return tree, total
+
+def cached_directory_tree(target, rel_root, depth, offset, limit, prune):
+    """Return (file_tree, total, etag), reusing the last walk if no directory changed
+    
+    A directory's mtime changes whenever an entry is added, removed or renamed
+    directly inside it, so revalidating a cached walk only needs one stat call
+    per directory it read. Walks that read a directory modified within
+    RACY_MTIME_WINDOW_NS of their start are not cached and get a None etag.
+    """
+    key = (str(target), depth, offset, limit, prune)
+    with tree_cache_lock:
+        cached = tree_cache.get(key)
+    if cached is not None:
+        try:
+            unchanged = all(
+                os.stat(path).st_mtime_ns == mtime for path, mtime in cached["mtimes"]
+            )
+        except OSError:
+            unchanged = False
+        if unchanged:
+            return cached["files"], cached["total"], cached["etag"]
+    
+    mtimes = []
+    started = time.time_ns()
+    file_tree, total = get_directory_tree(
+        target, rel_root, depth, offset, limit, mtimes, prune
+    )
+    mtimes = tuple(mtimes)
+    if any(
+        mtime is None or mtime >= started - RACY_MTIME_WINDOW_NS
+        for _, mtime in mtimes
+    ):
+        return file_tree, total, None
+    etag = 'W/"{}"'.format(
+        hashlib.blake2b(repr((key, mtimes)).encode(), digest_size=8).hexdigest()
+    )
+    
+    with tree_cache_lock:
+        tree_cache.pop(key, None)
+        tree_cache[key] = {
+            "mtimes": mtimes, "etag": etag, "files": file_tree, "total": total
+        }
+        if len(tree_cache) > TREE_CACHE_SIZE:
+            tree_cache.pop(next(iter(tree_cache)))
+    
+    return file_tree, total, etag
+
+@app.get("/workspace_info")
+async def workspace_info(
+    request: Request,
+    path: str = "",
+    depth: int = QueryParam(1, ge=1, le=MAX_TREE_DEPTH),
+    offset: int = QueryParam(0, ge=0),
+    limit: int = QueryParam(500, ge=1, le=5000),
+    include_hidden: bool = False,
+):
+    """Return information about the agent workspace
+    
+    Only `depth` levels below `path` are listed so clients can lazy-load
+    subtrees, and `offset`/`limit` page through the entries directly under `path`.
+    Directories in PRUNED_DIRS are left out unless `include_hidden` is set.
+    """
+    workspace_exists = os.path.exists(WORKSPACE_DIR)
+    
+    # Resolve the requested subtree and make sure it stays inside the workspace
+    workspace_root = WORKSPACE_DIR.resolve()
+    try:
+        target = (workspace_root / path).resolve()
+    except (ValueError, OSError):
+        raise HTTPException(status_code=400, detail=f"Invalid path: {path!r}")
+    if not target.is_relative_to(workspace_root):
+        raise HTTPException(status_code=400, detail="Path must be inside the workspace")
+    if target == workspace_root:
+        rel_root = ""
+    else:
+        rel_root = os.path.relpath(target, workspace_root)
     
     # Get file tree if workspace exists
     file_tree = []
+    total = 0
+    headers = {}
     if workspace_exists:
-        file_tree = get_directory_tree(WORKSPACE_DIR)
+        # Walk in a worker thread so other requests, notably long-polls on
+        # /result/{query_id}, keep being served meanwhile. The shared lock
+        # keeps a concurrent reset from deleting the tree underneath the walk.
+        async with workspace_lock.shared():
+            if not target.is_dir():
+                raise HTTPException(
+                    status_code=404, detail=f"Directory not found: {path}"
+                )
+            file_tree, total, etag = await asyncio.to_thread(
+                cached_directory_tree, target, rel_root, depth, offset, limit,
+                None if include_hidden else PRUNED_DIRS
+            )
+        if etag is not None:
+            if request.headers.get("if-none-match") == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            headers["ETag"] = etag
     
-    return {
+    # The file tree can be large, so encode it with orjson rather than
+    # going through FastAPI's jsonable_encoder and the stdlib json module
+    payload = {
         "workspace_path": str(WORKSPACE_DIR),
         "workspace_exists": workspace_exists,
+        "path": rel_root,
+        "offset": offset,
+        "limit": limit,
+        "total": total,
         "files": file_tree
     }
+    return Response(
+        orjson.dumps(payload), media_type="application/json", headers=headers
+    )
 
 @app.post("/reset_workspace")
 async def reset_workspace():
     """Reset the agent workspace by deleting and recreating it"""
-    try:
-        if os.path.exists(WORKSPACE_DIR):
-            shutil.rmtree(WORKSPACE_DIR)
-        os.makedirs(WORKSPACE_DIR, exist_ok=True)
-        return {"status": "success", "message": f"Workspace at {WORKSPACE_DIR} has been reset"}
-    except Exception as e:
-        return {"status": "error", "message": f"Error resetting workspace: {str(e)}"}
+    async with workspace_lock.exclusive():
+        with tree_cache_lock:
+            tree_cache.clear()
+        try:
+            # Deleting a cloned repository can take seconds, so keep it off the
+            # event loop
+            if os.path.exists(WORKSPACE_DIR):
+                await asyncio.to_thread(shutil.rmtree, WORKSPACE_DIR)
+            await asyncio.to_thread(os.makedirs, WORKSPACE_DIR, exist_ok=True)
+            return {
+                "status": "success",
+                "message": f"Workspace at {WORKSPACE_DIR} has been reset"
+            }
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Error resetting workspace: {str(e)}"
+            }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # uvicorn[standard] installs uvloop and httptools; name them explicitly so a
+    # missing install fails loudly instead of silently using asyncio and h11.
+    # Tasks and the shared agent live in process memory, so run a single worker.
+    # Set API_UDS to serve local clients over a Unix domain socket instead of TCP.
+    uds = os.getenv("API_UDS")
+    if uds:
+        uvicorn.run(app, uds=uds, loop="uvloop", http="httptools")
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools") 
\ No newline at end of file
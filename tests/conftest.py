@@ -0,0 +1,45 @@
+import importlib.util
+from pathlib import Path
+
+import httpx
+import pytest
+import pytest_asyncio
+
+
+@pytest.fixture(scope="session")
+def api():
+    """Load api.py once for the whole test session"""
+    api_path = Path(__file__).parents[1] / "api.py"
+    spec = importlib.util.spec_from_file_location("api", api_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def client(api):
+    """A single ASGI client shared by every test"""
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+
+
+@pytest_asyncio.fixture(autouse=True, loop_scope="session")
+async def stub_agent(api, monkeypatch):
+    """Keep tests from starting the real FastAgent and its MCP servers
+
+    Yields the real serve_agent for tests that run it against a fake FastAgent.
+    """
+    real_serve_agent = api.serve_agent
+
+    async def fake_serve_agent(ready, stop):
+        async def agent(text):
+            return f"Stub result for: {text}"
+
+        ready.set_result(agent)
+        await stop.wait()
+
+    await api.stop_agent()
+    monkeypatch.setattr(api, "serve_agent", fake_serve_agent)
+    yield real_serve_agent
+    await api.stop_agent()
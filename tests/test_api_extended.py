@@ -1,37 +1,294 @@
 import pytest
-import importlib.util
-from pathlib import Path
-import httpx
 import os
 import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from cachetools import TTLCache
 
-# Dynamically load api.py
-api_path = Path(__file__).parents[1] / "api.py"
-spec = importlib.util.spec_from_file_location("api", api_path)
-api = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(api)
-
-@pytest.mark.asyncio
-async def test_workspace_info_has_files():
-    transport = httpx.ASGITransport(app=api.app)
-    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
-        response = await ac.get("/workspace_info")
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+async def test_workspace_info_has_files(client):
+    response = await client.get("/workspace_info")
     assert response.status_code == 200
     data = response.json()
     assert data["workspace_exists"] is True
     assert isinstance(data["files"], list)
 
-@pytest.mark.asyncio
-async def test_invalid_result_lookup():
-    transport = httpx.ASGITransport(app=api.app)
-    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
-        response = await ac.get("/result/invalid_id_123")
+async def test_invalid_result_lookup(client):
+    response = await client.get("/result/invalid_id_123")
+    assert response.status_code == 200
+    assert response.json() == {"status": "not_found"}
+
+async def test_independent_endpoints_concurrently(client):
+    query, info, lookup = await asyncio.gather(
+        client.post("/query", json={"text": "Test deployment query"}),
+        client.get("/workspace_info"),
+        client.get("/result/invalid_id_123"),
+    )
+    assert query.status_code == 200
+    assert query.json()["status"] == "processing"
+    assert info.status_code == 200
+    assert "workspace_exists" in info.json()
+    assert lookup.json() == {"status": "not_found"}
+
+    result = await client.get(f"/result/{query.json()['query_id']}", params={"wait": 5})
+    assert result.json() == {
+        "status": "completed",
+        "result": "Stub result for: Test deployment query",
+    }
+
+async def test_missing_env(api, monkeypatch):
+    monkeypatch.setattr(api, "ANTHROPIC_API_KEY", None)
+    with pytest.raises(RuntimeError, match="not found in .env file"):
+        async with api.lifespan(api.app):
+            pass
+
+async def test_result_long_poll_wakes_on_completion(api, client):
+    api.active_tasks["poll_001"] = {"status": "processing", "result": None}
+    api.task_events["poll_001"] = asyncio.Event()
+
+    async def finish():
+        await asyncio.sleep(0.1)
+        api.finish_task("poll_001", "completed", "done")
+
+    response, _ = await asyncio.gather(
+        client.get("/result/poll_001", params={"wait": 5}), finish()
+    )
     assert response.status_code == 200
+    assert response.json() == {"status": "completed", "result": "done"}
+    assert "poll_001" not in api.task_events
+
+async def test_get_directory_tree_nested(api, tmp_path):
+    (tmp_path / "repo" / "src").mkdir(parents=True)
+    (tmp_path / "repo" / "src" / "main.py").write_text("")
+    (tmp_path / "README.md").write_text("")
+
+    # Walk in a worker thread, as /workspace_info does
+    tree, total = await asyncio.to_thread(api.get_directory_tree, tmp_path)
+    assert total == 2
+    assert [item["name"] for item in tree] == ["README.md", "repo"]
+    repo = tree[1]
+    assert repo["type"] == "directory"
+    src = repo["children"][0]
+    assert src["path"] == os.path.join("repo", "src")
+    assert src["children"] == [
+        {
+            "name": "main.py",
+            "path": os.path.join("repo", "src", "main.py"),
+            "type": "file",
+        }
+    ]
+
+async def test_workspace_info_depth_and_paging(api, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "WORKSPACE_DIR", tmp_path)
+    (tmp_path / "repo" / "src").mkdir(parents=True)
+    (tmp_path / "empty").mkdir()
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        (tmp_path / name).write_text("")
+
+    top = (await client.get("/workspace_info")).json()
+    page = await client.get("/workspace_info", params={"offset": 1, "limit": 2})
+    page = page.json()
+    sub = (await client.get("/workspace_info", params={"path": "repo"})).json()
+
+    assert top["total"] == 5
+    by_name = {item["name"]: item for item in top["files"]}
+    assert by_name["repo"]["has_children"] is True
+    assert by_name["empty"]["has_children"] is False
+    assert "children" not in by_name["repo"]
+    assert [item["name"] for item in page["files"]] == ["b.txt", "c.txt"]
+    assert sub["path"] == "repo"
+    assert sub["files"][0]["path"] == os.path.join("repo", "src")
+
+async def test_workspace_info_rejects_paths_outside_workspace(
+    api, client, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(api, "WORKSPACE_DIR", tmp_path / "workspace")
+    (tmp_path / "workspace").mkdir()
+    response = await client.get("/workspace_info", params={"path": "../"})
+    assert response.status_code == 400
+    response = await client.get("/workspace_info", params={"path": "a\x00b"})
+    assert response.status_code == 400
+
+async def test_workspace_info_rejects_excessive_depth(api, client):
+    response = await client.get(
+        "/workspace_info", params={"depth": api.MAX_TREE_DEPTH + 1}
+    )
+    assert response.status_code == 422
+
+def backdate(*paths):
+    old = time.time_ns() - 60_000_000_000
+    for path in paths:
+        os.utime(path, ns=(old, old))
+
+async def test_workspace_info_etag(api, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "WORKSPACE_DIR", tmp_path)
+    (tmp_path / "repo").mkdir()
+    backdate(tmp_path, tmp_path / "repo")
+
+    first = await client.get("/workspace_info")
+    etag = first.headers["etag"]
+    cached = await client.get("/workspace_info", headers={"If-None-Match": etag})
+
+    (tmp_path / "repo" / "new.txt").write_text("")
+    changed = await client.get("/workspace_info", headers={"If-None-Match": etag})
+
+    backdate(tmp_path / "repo")
+    settled = await client.get("/workspace_info", headers={"If-None-Match": etag})
+
+    assert first.json()["files"][0]["has_children"] is False
+    assert cached.status_code == 304
+    # The change is too recent for its mtime to be trusted yet
+    assert changed.status_code == 200
+    assert "etag" not in changed.headers
+    assert changed.json()["files"][0]["has_children"] is True
+    assert settled.status_code == 200
+    assert settled.headers["etag"] != etag
+
+async def test_run_agent_reuses_shared_agent(api, stub_agent, monkeypatch):
+    started = []
+    agents = []
+
+    class FakeAgent:
+        """Records every message and LLM turn the way fast-agent does"""
+
+        def __init__(self, use_history):
+            self.use_history = use_history
+            self.message_history = []
+            self.usage_accumulator = SimpleNamespace(turns=[])
+
+        async def send(self, text):
+            context = self.message_history if self.use_history else []
+            reply = " | ".join([*context, text])
+            self.message_history.extend([text, reply])
+            self.usage_accumulator.turns.append(object())
+            return reply
+
+    class FakeFastAgent:
+        def __init__(self, name, **kwargs):
+            self.agent_kwargs = {}
+
+        def agent(self, **kwargs):
+            self.agent_kwargs = kwargs
+            return lambda func: func
+
+        @asynccontextmanager
+        async def run(self):
+            started.append(True)
+            agent = FakeAgent(self.agent_kwargs.get("use_history", True))
+            agents.append(agent)
+            yield {self.agent_kwargs["name"]: agent}
+
+    # Run the real serve_agent against the fake FastAgent
+    monkeypatch.setattr(api, "serve_agent", stub_agent)
+    monkeypatch.setattr(api, "FastAgent", FakeFastAgent)
+    await api.run_agent("shared_001", "first")
+    await api.run_agent("shared_002", "second")
+    await api.stop_agent()
+
+    assert started == [True]
+    assert api.active_tasks["shared_001"] == {"status": "completed", "result": "first"}
+    # The second query must not see the first query's messages
+    assert api.active_tasks["shared_002"] == {"status": "completed", "result": "second"}
+    # Nothing recorded for a query outlives it
+    assert agents[0].message_history == []
+    assert agents[0].usage_accumulator.turns == []
+
+async def test_run_agent_restarts_agent_after_connection_error(api, monkeypatch):
+    started = []
+
+    async def fake_serve_agent(ready, stop):
+        generation = len(started)
+        started.append(True)
+
+        async def agent(text):
+            if generation == 0:
+                raise ConnectionError("MCP server went away")
+            return f"answered by agent {generation}"
+
+        ready.set_result(agent)
+        await stop.wait()
+
+    await api.stop_agent()
+    monkeypatch.setattr(api, "serve_agent", fake_serve_agent)
+    await api.run_agent("restart_001", "first")
+    await api.run_agent("restart_002", "second")
+
+    assert api.active_tasks["restart_001"]["status"] == "error"
+    assert api.active_tasks["restart_002"] == {
+        "status": "completed",
+        "result": "answered by agent 1",
+    }
+    assert len(started) == 2
+
+async def test_finished_task_expires(api, client, monkeypatch):
+    now = [0]
+    tasks = TTLCache(maxsize=10, ttl=60, timer=lambda: now[0])
+    monkeypatch.setattr(api, "active_tasks", tasks)
+    api.finish_task("old_001", "completed", "done")
+    now[0] = 61
+
+    response = await client.get("/result/old_001")
     assert response.json() == {"status": "not_found"}
 
-@pytest.mark.asyncio
-async def test_missing_env(monkeypatch):
-    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
-    await api.run_agent("test_001", "Deploy something")
-    assert api.active_tasks["test_001"]["status"] == "error"
-    assert "not found in .env file" in api.active_tasks["test_001"]["result"]
+async def test_workspace_info_prunes_noise_directories(
+    api, client, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(api, "WORKSPACE_DIR", tmp_path)
+    (tmp_path / "repo" / ".git" / "objects").mkdir(parents=True)
+    (tmp_path / "repo" / "app.py").write_text("")
+    (tmp_path / "vendor" / "node_modules").mkdir(parents=True)
+
+    top = await client.get("/workspace_info")
+    default = await client.get("/workspace_info", params={"depth": 2})
+    hidden = await client.get(
+        "/workspace_info", params={"depth": 2, "include_hidden": "true"}
+    )
+
+    vendor = top.json()["files"][1]
+    assert vendor["has_children"] is False
+    repo = default.json()["files"][0]
+    assert [item["name"] for item in repo["children"]] == ["app.py"]
+    repo = hidden.json()["files"][0]
+    assert [item["name"] for item in repo["children"]] == [".git", "app.py"]
+
+async def test_reset_during_workspace_info(api, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "WORKSPACE_DIR", tmp_path / "workspace")
+    for i in range(20):
+        (tmp_path / "workspace" / f"dir{i}" / "a" / "b").mkdir(parents=True)
+
+    info, first_reset, second_reset = await asyncio.gather(
+        client.get("/workspace_info", params={"depth": 10}),
+        client.post("/reset_workspace"),
+        client.post("/reset_workspace"),
+    )
+    assert info.status_code == 200
+    assert first_reset.json()["status"] == "success"
+    assert second_reset.json()["status"] == "success"
+
+    after = await client.get("/workspace_info")
+    assert after.json()["files"] == []
+
+
+async def test_workspace_info_walks_run_concurrently(
+    api, client, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(api, "WORKSPACE_DIR", tmp_path / "workspace")
+    (tmp_path / "workspace").mkdir()
+    # Each walk waits for the other, so serialized walks would break the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    real_cached_directory_tree = api.cached_directory_tree
+
+    def waiting_cached_directory_tree(*args):
+        barrier.wait()
+        return real_cached_directory_tree(*args)
+
+    monkeypatch.setattr(api, "cached_directory_tree", waiting_cached_directory_tree)
+    first, second = await asyncio.gather(
+        client.get("/workspace_info"),
+        client.get("/workspace_info", params={"depth": 2}),
+    )
+    assert first.status_code == 200
+    assert second.status_code == 200